@@ -1,51 +1,215 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, flash, session, jsonify, g,
+                   has_app_context, Response, stream_with_context)
+from flask.json.provider import DefaultJSONProvider
 import os
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from werkzeug.security import generate_password_hash, check_password_hash
 import google.generativeai as genai
-from pypdf import PdfReader
 import json
+import logging
+import orjson
+import hashlib
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dotenv import load_dotenv
 import re
 import requests
 from urllib.parse import urlparse, parse_qs
+import shutil
+import subprocess
+import threading
+import multiprocessing
+import time
+import atexit
+from collections import deque
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
 
 # Load environment variables
 load_dotenv()
 
+# One stderr handler for the whole app (and gunicorn's workers); LOG_LEVEL=DEBUG
+# shows the per-request generation details logged at debug level
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+                    format='%(asctime)s %(levelname)s [%(name)s] %(message)s')
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that serializes jsonify() responses and |tojson with orjson"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# Every gunicorn worker (and every restart) must sign sessions with the same
+# key, so it comes from the environment rather than being generated here
+app.secret_key = os.getenv('SECRET_KEY')
+if not app.secret_key:
+    raise RuntimeError("SECRET_KEY is not set; add it to .env or the environment")
+app.json = OrjsonProvider(app)
 
 # Configuration
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max file size
+# Longest slice of a material's text any AI prompt uses (the mindmap), so PDF
+# extraction can stop once this many characters have been read
+MAX_MATERIAL_CHARS = 30000
+# Characters of material text sent with summary, flashcard and quiz prompts;
+# bounds prompt size (and Gemini prefill time) regardless of document length
+PROMPT_TEXT_CHARS = 8000
+# Characters of material text given to the chat and explain-like-5 prompts
+CHAT_CONTEXT_CHARS = 4000
+# Cached Gemini responses older than this are pruned at startup
+LLM_CACHE_TTL_DAYS = 30
 GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
 
 # Configure Gemini AI
 if GEMINI_API_KEY:
-    genai.configure(api_key=GEMINI_API_KEY)
+    # gRPC keeps a single persistent HTTP/2 channel per client, and the SDK
+    # caches one default client per process, so every thread and request
+    # reuses the same TLS connection through the module-level model below
+    genai.configure(api_key=GEMINI_API_KEY, transport='grpc')
     model_name = 'gemini-2.5-flash-lite'  # User's preferred model
-    print(f"Initializing Gemini AI with model: {model_name}")
+    logger.info("Initializing Gemini AI with model: %s", model_name)
     try:
         model = genai.GenerativeModel(model_name)
-        print(f"✓ Gemini AI model initialized successfully")
+        logger.info("Gemini AI model initialized successfully")
     except Exception as e:
-        print(f"ERROR: Failed to initialize model '{model_name}': {e}")
-        print(f"Available models might be: gemini-pro, gemini-1.5-pro, gemini-1.5-flash")
+        logger.error("Failed to initialize model '%s': %s (available models might be: gemini-pro, "
+                     "gemini-1.5-pro, gemini-1.5-flash)", model_name, e)
         model = None
 else:
-    print("Warning: GOOGLE_API_KEY not found in .env file")
+    logger.warning("GOOGLE_API_KEY not found in .env file")
     model = None
 
+def warm_up_model():
+    """Open the Gemini channel (DNS, TLS, HTTP/2) before the first real request needs it"""
+    try:
+        # count_tokens is a free round trip that builds the same client generate_content uses
+        model.count_tokens("ping", request_options={'timeout': 10})
+    except Exception as e:
+        logger.warning("Gemini warm-up failed: %s", e)
+
+# Not in PDF worker processes, which import this module but never call Gemini
+if model and multiprocessing.parent_process() is None:
+    threading.Thread(target=warm_up_model, name='gemini-warm-up', daemon=True).start()
+
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Background threads that generate AI content for uploaded materials, so
+# /upload can respond as soon as the text is extracted
+# Background generations still 'processing' after this long are treated as lost
+GENERATION_TIMEOUT_SECONDS = 600
+# Same for on-demand generation jobs; comfortably above gunicorn's 120s worker timeout
+JOB_TIMEOUT_SECONDS = 180
+_generation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='study-content')
+# Long-lived threads for the concurrent Gemini calls within one generation, so
+# each keeps its thread-local DB connection between requests. Kept separate
+# from _generation_executor, whose tasks wait on these calls.
+_llm_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='gemini-call')
+
+# On-demand generations currently running, keyed by (kind, material_id, count),
+# so near-simultaneous requests for the same material share one Gemini call
+_inflight_generations = {}
+_inflight_lock = threading.Lock()
+
+# Worker processes for CPU-bound PDF parsing, created on the first large
+# multi-file upload. Kept small because every gunicorn worker has its own pool,
+# and started via forkserver so they are never forked from this process while
+# its gRPC and executor threads are running.
+PDF_PROCESS_WORKERS = 2
+# Below this many bytes in total, parsing inline beats shipping the PDFs to workers
+PDF_POOL_MIN_BYTES = 2 * 1024 * 1024
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+# Page-view activity rows are buffered and written in batches, flushed when
+# ACTIVITY_FLUSH_SIZE rows are queued or ACTIVITY_FLUSH_INTERVAL seconds pass
+ACTIVITY_FLUSH_SIZE = 50
+ACTIVITY_FLUSH_INTERVAL = 2.0  # seconds
+_activity_buffer = deque()
+_activity_lock = threading.Lock()
+_activity_timer = None
+
+# Recently failed password checks, keyed by (stored hash, digest of attempted
+# password), so rapid duplicate retries don't re-run the password KDF
+FAILED_LOGIN_TTL = 1.0  # seconds
+FAILED_LOGIN_CACHE_SIZE = 1024
+_failed_logins = {}
+_failed_logins_lock = threading.Lock()
+
+# Parsers for Gemini output and subtitle files
+_JSON_DECODER = json.JSONDecoder()
+_QA_PAIR_RE = re.compile(r'"question"\s*:\s*"([^"]+)"[^}]*"answer"\s*:\s*"([^"]+)"', re.DOTALL)
+_XML_TAG_RE = re.compile(r"<[^>]+>")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Keyword sets for answering detect_subject locally on clear-cut texts. Only
+# subject-specific terms and phrases: generic words such as "cell", "matrix",
+# "proof" or "base" appear across subjects and would give confident wrong labels.
+SUBJECT_KEYWORDS = {
+    "Machine Learning": {
+        "machine learning", "neural network", "neural networks", "gradient descent", "overfitting",
+        "underfitting", "backpropagation", "supervised learning", "unsupervised learning",
+        "training data", "loss function", "deep learning", "activation function", "activation functions",
+        "attention mechanism", "word embeddings", "hyperparameter", "hyperparameters",
+        "convolutional neural network", "reinforcement learning",
+    },
+    "Physics": {
+        "newton's laws", "quantum mechanics", "thermodynamics", "kinetic energy", "potential energy",
+        "electromagnetic", "relativity", "projectile motion", "gravitational", "magnetic field",
+        "electric field", "angular momentum",
+    },
+    "Mathematics": {
+        "theorem", "lemma", "corollary", "polynomial", "eigenvalue", "eigenvalues", "calculus",
+        "linear algebra", "topology", "differential equation", "differential equations",
+    },
+    "History": {
+        "empire", "dynasty", "colonial", "colonialism", "treaty", "monarchy", "medieval",
+        "world war", "industrial revolution", "french revolution", "parliament",
+    },
+    "Biology": {
+        "dna", "rna", "enzyme", "enzymes", "organism", "organisms", "photosynthesis", "mitosis",
+        "meiosis", "genetics", "chromosome", "chromosomes", "ecosystem", "natural selection",
+        "cell membrane", "cell division",
+    },
+    "Chemistry": {
+        "chemical reaction", "chemical reactions", "covalent bond", "ionic bond", "redox",
+        "stoichiometry", "molarity", "periodic table", "catalyst", "electronegativity",
+    },
+    "Computer Science": {
+        "data structure", "data structures", "compiler", "operating system", "recursion",
+        "time complexity", "binary tree", "linked list", "hash table", "network protocol",
+        "sorting algorithm",
+    },
+}
+SUBJECT_MIN_HITS = 3
+SUBJECT_CONFIDENCE_RATIO = 1.5
+_SUBJECT_BY_KEYWORD = {kw: subject for subject, keywords in SUBJECT_KEYWORDS.items() for kw in keywords}
+# Longest keywords first so multi-word phrases win over their prefixes
+_SUBJECT_KEYWORD_RE = re.compile(
+    r"\b(?:" + "|".join(re.escape(kw) for kw in sorted(_SUBJECT_BY_KEYWORD, key=len, reverse=True)) + r")\b"
+)
+
 # Database initialization
 def init_db():
     conn = sqlite3.connect('intellexa.db')
     c = conn.cursor()
     
+    # WAL is persistent on the database file, so it only needs setting once
+    c.execute('PRAGMA journal_mode=WAL')
+    
     # Users table
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -65,10 +229,20 @@ def init_db():
         file_path TEXT,
         text_content TEXT,
         summary TEXT,
+        content_sha256 TEXT,
+        generation_status TEXT NOT NULL DEFAULT 'ready',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         FOREIGN KEY (user_id) REFERENCES users(id)
     )''')
     
+    # Columns added after the first release
+    material_columns = {row[1] for row in c.execute('PRAGMA table_info(materials)')}
+    if 'content_sha256' not in material_columns:
+        c.execute('ALTER TABLE materials ADD COLUMN content_sha256 TEXT')
+    if 'generation_status' not in material_columns:
+        # 'processing' while background AI generation runs, then 'ready' or 'failed'
+        c.execute("ALTER TABLE materials ADD COLUMN generation_status TEXT NOT NULL DEFAULT 'ready'")
+    
     # Flashcards table
     c.execute('''CREATE TABLE IF NOT EXISTS flashcards (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -114,6 +288,38 @@ def init_db():
         FOREIGN KEY (material_id) REFERENCES materials(id)
     )''')
     
+    # Indexes for the per-user dashboard/analytics queries and per-material lookups
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ua_user_created ON user_activity(user_id, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_materials_user_created ON materials(user_id, created_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_qa_user_completed ON quiz_attempts(user_id, completed_at DESC)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_flashcards_material ON flashcards(material_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_quizzes_material ON quizzes(material_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_materials_sha256 ON materials(content_sha256)')
+    # Child-key indexes for delete_material, which also lets the foreign key
+    # check on DELETE FROM materials probe instead of scanning these tables
+    c.execute('CREATE INDEX IF NOT EXISTS idx_ua_material ON user_activity(material_id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_qa_material ON quiz_attempts(material_id)')
+    
+    # Gemini response cache, keyed by a hash of model + prompt + generation config
+    c.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+        key BLOB PRIMARY KEY,
+        value TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+    
+    # On-demand generation jobs; result holds the JSON response once finished
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',
+        result TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users(id)
+    )''')
+    
+    c.execute("DELETE FROM llm_cache WHERE created_at < datetime('now', ?)",
+              (f'-{LLM_CACHE_TTL_DAYS} days',))
+    
     conn.commit()
     conn.close()
 
@@ -121,23 +327,230 @@ def init_db():
 init_db()
 
 # Helper functions
-def get_db():
-    conn = sqlite3.connect('intellexa.db')
+# Statements shared by several routes. Python's sqlite3 caches prepared
+# statements by SQL text, so reusing one string keeps them on a single entry
+SQL_GET_MATERIAL_TEXT = 'SELECT SUBSTR(text_content, 1, ?) AS text_content FROM materials WHERE id = ?'
+SQL_GET_USER_MATERIAL_TEXT = ('SELECT SUBSTR(text_content, 1, ?) AS text_content FROM materials '
+                              'WHERE id = ? AND user_id = ?')
+SQL_DELETE_FLASHCARDS = 'DELETE FROM flashcards WHERE material_id = ?'
+SQL_DELETE_QUIZZES = 'DELETE FROM quizzes WHERE material_id = ?'
+SQL_INSERT_FLASHCARD = 'INSERT INTO flashcards (material_id, question, answer) VALUES (?, ?, ?)'
+SQL_INSERT_QUIZ = 'INSERT INTO quizzes (material_id, question, options, correct_answer) VALUES (?, ?, ?, ?)'
+
+def connect_db():
+    """Open a new SQLite connection; the caller is responsible for closing it"""
+    # Writes take the WAL write lock at BEGIN (IMMEDIATE) so two writers
+    # wait on the busy timeout instead of failing on a read-to-write upgrade
+    conn = sqlite3.connect('intellexa.db', timeout=5.0, isolation_level='IMMEDIATE',
+                           cached_statements=256)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')
+    conn.execute('PRAGMA foreign_keys=ON')
     return conn
 
-def extract_text_from_pdf(pdf_path):
-    """Extract text from PDF file"""
+_thread_db = threading.local()
+
+def get_db():
+    """Return the current request's SQLite connection, opened on first use and closed on teardown.
+
+    Outside an app context (background jobs, executor threads) each thread keeps
+    one connection for its lifetime instead of reopening the database per call.
+    """
+    if not has_app_context():
+        if getattr(_thread_db, 'conn', None) is None:
+            _thread_db.conn = connect_db()
+        return _thread_db.conn
+    if '_db' not in g:
+        g._db = connect_db()
+    return g._db
+
+@app.teardown_appcontext
+def close_db(exception):
+    db = g.pop('_db', None)
+    if db is not None:
+        db.close()
+
+def save_material(conn, user_id, material, flashcards_data, quiz_data, activity_type):
+    """Insert a material with its flashcards, quiz questions and activity log in one transaction"""
+    with conn:
+        cursor = conn.execute('''
+            INSERT INTO materials (user_id, title, subject, file_type, file_path, text_content, summary,
+                                   content_sha256, generation_status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (user_id, material['title'], material['subject'], material['file_type'],
+              material['file_path'], material['text_content'], material['summary'],
+              material.get('content_sha256'), material.get('generation_status', 'ready')))
+        material_id = cursor.lastrowid
+        insert_study_cards(conn, material_id, flashcards_data, quiz_data)
+        conn.execute('INSERT INTO user_activity (user_id, material_id, activity_type) VALUES (?, ?, ?)',
+                     (user_id, material_id, activity_type))
+    return material_id
+
+def insert_study_cards(conn, material_id, flashcards_data, quiz_data):
+    """Insert a material's flashcards and quiz questions (caller manages the transaction)"""
+    conn.executemany(SQL_INSERT_FLASHCARD,
+                     [(material_id, fc.get('question', ''), fc.get('answer', '')) for fc in flashcards_data])
+    conn.executemany(SQL_INSERT_QUIZ,
+                     [(material_id, q.get('question', ''), orjson.dumps(q.get('options', [])).decode(), q.get('correct', 0))
+                      for q in quiz_data])
+
+def load_material_by_hash(conn, content_sha256):
+    """Return (material, flashcards, quiz) of the latest material uploaded with the same file content, or None"""
+    row = conn.execute('''
+        SELECT id, subject, file_type, text_content, summary FROM materials
+        WHERE content_sha256 = ? AND generation_status = 'ready'
+        ORDER BY id DESC
+        LIMIT 1
+    ''', (content_sha256,)).fetchone()
+    if not row:
+        return None
+    
+    # Unpack rows positionally rather than by column name in the per-row loops
+    flashcards_data = [{'question': question, 'answer': answer} for question, answer in conn.execute(
+        'SELECT question, answer FROM flashcards WHERE material_id = ?', (row['id'],))]
+    quiz_data = [{'question': question, 'options': orjson.loads(options), 'correct': correct}
+                 for question, options, correct in conn.execute(
+                     'SELECT question, options, correct_answer FROM quizzes WHERE material_id = ?', (row['id'],))]
+    material = {
+        'subject': row['subject'],
+        'file_type': row['file_type'],
+        'text_content': row['text_content'],
+        'summary': row['summary']
+    }
+    return material, flashcards_data, quiz_data
+
+def log_activity(user_id, material_id, activity_type):
+    """Queue a user_activity row; it is written by the next flush_activity"""
+    global _activity_timer
+    # Same format and timezone as SQLite's CURRENT_TIMESTAMP default
+    created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    with _activity_lock:
+        _activity_buffer.append((user_id, material_id, activity_type, created_at))
+        flush_now = len(_activity_buffer) >= ACTIVITY_FLUSH_SIZE
+        if not flush_now and _activity_timer is None:
+            _activity_timer = threading.Timer(ACTIVITY_FLUSH_INTERVAL, flush_activity)
+            _activity_timer.daemon = True
+            _activity_timer.start()
+    if flush_now:
+        flush_activity()
+
+def flush_activity():
+    """Write all buffered user_activity rows in one transaction"""
+    global _activity_timer
+    with _activity_lock:
+        events = list(_activity_buffer)
+        _activity_buffer.clear()
+        if _activity_timer is not None:
+            _activity_timer.cancel()
+            _activity_timer = None
+    if not events:
+        return
+    
+    conn = get_db()
+    try:
+        with conn:
+            # Skip events for materials deleted since they were buffered, which
+            # would otherwise fail the foreign key and lose the whole batch
+            conn.executemany('''
+                INSERT INTO user_activity (user_id, material_id, activity_type, created_at)
+                SELECT ?1, ?2, ?3, ?4
+                WHERE ?2 IS NULL OR EXISTS (SELECT 1 FROM materials WHERE id = ?2)
+            ''', events)
+    except Exception as e:
+        logger.error("Error saving activity log: %s", e)
+
+atexit.register(flush_activity)
+
+def verify_password(password_hash, password):
+    """check_password_hash that remembers failures briefly to absorb duplicate retries"""
+    key = (password_hash, hashlib.blake2b(password.encode('utf-8')).digest())
+    now = time.monotonic()
+    with _failed_logins_lock:
+        failed_at = _failed_logins.get(key)
+        if failed_at is not None and now - failed_at < FAILED_LOGIN_TTL:
+            return False
+    
+    if check_password_hash(password_hash, password):
+        return True
+    
+    with _failed_logins_lock:
+        _failed_logins.pop(key, None)
+        _failed_logins[key] = now
+        # Entries are kept in insertion order, so the oldest come first
+        while _failed_logins and (len(_failed_logins) > FAILED_LOGIN_CACHE_SIZE
+                                  or now - next(iter(_failed_logins.values())) >= FAILED_LOGIN_TTL):
+            _failed_logins.pop(next(iter(_failed_logins)))
+    return False
+
+def extract_text_from_pdf(pdf_source, max_chars=None):
+    """Extract text from a PDF file path or the PDF's bytes (PyMuPDF, falling back to poppler's pdftotext).
+    
+    When max_chars is given, stop parsing pages once that much text has been read.
+    """
+    in_memory = isinstance(pdf_source, (bytes, bytearray))
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        if fitz is not None:
+            parts = []
+            total_len = 0
+            doc = fitz.open(stream=pdf_source, filetype="pdf") if in_memory else fitz.open(pdf_source)
+            with doc:
+                for page in doc:
+                    page_text = page.get_text("text")
+                    parts.append(page_text)
+                    total_len += len(page_text)
+                    if max_chars is not None and total_len >= max_chars:
+                        break
+            text = "\n".join(parts)
+        elif shutil.which('pdftotext'):
+            result = subprocess.run(['pdftotext', '-enc', 'UTF-8', '-' if in_memory else pdf_source, '-'],
+                                    input=pdf_source if in_memory else None,
+                                    capture_output=True, check=True)
+            text = result.stdout.decode('utf-8', errors='replace')
+        else:
+            logger.error("No PDF extractor available. Please install it with: pip install PyMuPDF")
+            return None
+        return text[:max_chars].strip()
     except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
+        logger.error("Error extracting text from PDF: %s", e)
         return None
 
+def extract_texts_from_pdfs(pdf_sources):
+    """Extract text from several PDFs (paths or bytes), parsing large batches in parallel worker processes"""
+    global _pdf_executor
+    total_bytes = sum(len(source) if isinstance(source, (bytes, bytearray)) else os.path.getsize(source)
+                      for source in pdf_sources)
+    if len(pdf_sources) < 2 or total_bytes < PDF_POOL_MIN_BYTES:
+        return [extract_text_from_pdf(source, max_chars=MAX_MATERIAL_CHARS) for source in pdf_sources]
+    
+    executor = None
+    try:
+        with _pdf_executor_lock:
+            if _pdf_executor is None:
+                _pdf_executor = ProcessPoolExecutor(max_workers=PDF_PROCESS_WORKERS,
+                                                    mp_context=multiprocessing.get_context('forkserver'))
+            executor = _pdf_executor
+        return list(executor.map(extract_text_from_pdf, pdf_sources, [MAX_MATERIAL_CHARS] * len(pdf_sources)))
+    except (BrokenProcessPool, ValueError, OSError) as e:
+        # A worker died, or forkserver is unavailable (e.g. on Windows): drop
+        # the pool so the next batch starts a fresh one, and parse this batch inline
+        logger.warning("PDF worker pool unavailable, parsing inline: %s", e)
+        with _pdf_executor_lock:
+            if executor is not None and _pdf_executor is executor:
+                _pdf_executor = None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return [extract_text_from_pdf(source, max_chars=MAX_MATERIAL_CHARS) for source in pdf_sources]
+
+def save_upload(original_filename, data):
+    """Write an uploaded file's bytes to the upload folder and return its path"""
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{timestamp}_{original_filename}")
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    return filepath
+
 def extract_video_id(youtube_url):
     """Extract video ID from YouTube URL"""
     try:
@@ -154,15 +567,13 @@ def extract_video_id(youtube_url):
             return parsed_url.path.lstrip('/')
         return None
     except Exception as e:
-        print(f"Error extracting video ID: {e}")
+        logger.warning("Error extracting video ID: %s", e)
         return None
 
 def get_youtube_transcript(video_url):
     """Get transcript from YouTube video using yt_dlp (supports Hindi and English)"""
     try:
         import yt_dlp
-        import re
-        import requests
 
         ydl_opts = {
             "skip_download": True,
@@ -194,15 +605,15 @@ def get_youtube_transcript(video_url):
             # Fetch and clean subtitle content
             xml_text = requests.get(subtitle_url).text
             # Remove XML tags and extra whitespace
-            text = re.sub(r"<[^>]+>", "", xml_text)
-            text = re.sub(r"\s+", " ", text).strip()
+            text = _XML_TAG_RE.sub("", xml_text)
+            text = _WHITESPACE_RE.sub(" ", text).strip()
             return text
 
     except ImportError:
-        print("yt_dlp not installed. Please install it with: pip install yt-dlp")
+        logger.error("yt_dlp not installed. Please install it with: pip install yt-dlp")
         return None
     except Exception as e:
-        print(f"Error getting transcript for video: {e}")
+        logger.error("Error getting transcript for video: %s", e)
         return None
 
 def get_video_title(video_id):
@@ -212,7 +623,7 @@ def get_video_title(video_id):
         # For now, we'll use a simple approach or skip it
         return f"YouTube Video {video_id}"
     except Exception as e:
-        print(f"Error getting video title: {e}")
+        logger.warning("Error getting video title: %s", e)
         return f"YouTube Video {video_id}"
 
 def create_mindmap_markdown(text):
@@ -220,8 +631,7 @@ def create_mindmap_markdown(text):
     if not model:
         return None
     try:
-        max_chars = 30000
-        clipped = text[:max_chars]
+        clipped = text[:MAX_MATERIAL_CHARS]
         prompt = f"""
         Create a hierarchical markdown mindmap from the following text.
         Use proper markdown heading syntax (# for main topics, ## for subtopics, ### for details).
@@ -246,9 +656,47 @@ def create_mindmap_markdown(text):
         response = model.generate_content(prompt)
         return response.text.strip() if hasattr(response, 'text') and response.text else None
     except Exception as e:
-        print(f"Error generating mindmap markdown: {e}")
+        logger.error("Error generating mindmap markdown: %s", e)
         return None
 
+def llm_cache_key(prompt, generation_config=None):
+    """Hash the model name, prompt and generation config into an llm_cache key"""
+    return hashlib.blake2b(json.dumps(
+        [getattr(model, 'model_name', None), prompt, generation_config], sort_keys=True
+    ).encode('utf-8')).digest()
+
+def get_cached_response(key):
+    """Return the stored response text for an llm_cache key, or None"""
+    row = get_db().execute('SELECT value FROM llm_cache WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else None
+
+def store_cached_response(key, text):
+    """Save a response text under an llm_cache key"""
+    conn = get_db()
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO llm_cache (key, value) VALUES (?, ?)', (key, text))
+
+def generate_content_cached(prompt, generation_config=None, is_valid=None):
+    """Return Gemini's response text for a prompt, reusing the stored answer for repeated prompts.
+    
+    Only text accepted by is_valid (when given) is stored or reused, so an
+    unparseable response is retried on the next call instead of being replayed.
+    """
+    key = llm_cache_key(prompt, generation_config)
+    cached = get_cached_response(key)
+    if cached and (is_valid is None or is_valid(cached)):
+        return cached
+    
+    if generation_config:
+        response = model.generate_content(prompt, generation_config=generation_config)
+    else:
+        response = model.generate_content(prompt)
+    text = response.text
+    
+    if text and (is_valid is None or is_valid(text)):
+        store_cached_response(key, text)
+    return text
+
 def build_markmap_html(markdown_content):
     """Return a full HTML document that renders a Markmap with theme colors."""
     if not markdown_content:
@@ -301,44 +749,116 @@ def build_mermaid_flow_html(text):
     """Deprecated: concept flow removed."""
     return None
 
+def build_summary_prompt(text, difficulty="standard"):
+    """Build the Gemini prompt for a summary at the given difficulty"""
+    difficulty_prompts = {
+        'beginner': 'in very simple terms suitable for beginners',
+        'standard': 'in a balanced way suitable for most learners',
+        'intermediate': 'with detailed explanations for intermediate learners',
+        'advanced': 'with technical depth for advanced learners',
+        'exam-prep': 'focusing on key concepts for exam preparation'
+    }
+    
+    return f"""Summarize the following text {difficulty_prompts.get(difficulty, difficulty_prompts['standard'])}. 
+        Provide a clear, concise summary that captures the main ideas and key concepts.
+        
+        Text: {text[:PROMPT_TEXT_CHARS]}"""
+
+def extract_json_array(text):
+    """Return the first JSON array of objects embedded in text (code fences, surrounding prose), or None"""
+    start = text.find('[')
+    while start != -1:
+        try:
+            value, _ = _JSON_DECODER.raw_decode(text, start)
+        except ValueError:
+            pass
+        else:
+            if isinstance(value, list) and any(isinstance(item, dict) for item in value):
+                return value
+        start = text.find('[', start + 1)
+    return None
+
+SUMMARY_UNAVAILABLE = "AI service not available. Please configure GOOGLE_API_KEY in .env file."
+SUMMARY_FAILED = "Error generating summary. Please try again."
+
 def generate_summary(text, difficulty="standard"):
     """Generate summary using Gemini AI"""
     if not model:
-        return "AI service not available. Please configure GOOGLE_API_KEY in .env file."
+        return SUMMARY_UNAVAILABLE
     
     try:
-        difficulty_prompts = {
-            'beginner': 'in very simple terms suitable for beginners',
-            'standard': 'in a balanced way suitable for most learners',
-            'intermediate': 'with detailed explanations for intermediate learners',
-            'advanced': 'with technical depth for advanced learners',
-            'exam-prep': 'focusing on key concepts for exam preparation'
-        }
-        
-        prompt = f"""Summarize the following text {difficulty_prompts.get(difficulty, difficulty_prompts['standard'])}. 
-        Provide a clear, concise summary that captures the main ideas and key concepts.
+        return generate_content_cached(build_summary_prompt(text, difficulty))
+    except Exception as e:
+        logger.error("Error generating summary: %s", e)
+        return SUMMARY_FAILED
+
+def stream_summary(text, difficulty="standard"):
+    """Yield a summary in chunks as Gemini produces them (raises on API errors)"""
+    if not model:
+        yield SUMMARY_UNAVAILABLE
+        return
+    
+    prompt = build_summary_prompt(text, difficulty)
+    key = llm_cache_key(prompt)
+    cached = get_cached_response(key)
+    if cached:
+        yield cached
+        return
+    
+    parts = []
+    for chunk in model.generate_content(prompt, stream=True):
+        if chunk.parts:
+            parts.append(chunk.text)
+            yield chunk.text
+    
+    if parts:
+        store_cached_response(key, "".join(parts))
+
+def parse_flashcards(response_text, num_cards):
+    """Extract valid question/answer flashcards from a Gemini response, or []"""
+    # Try to find complete JSON array
+    flashcards = extract_json_array(response_text)
+    
+    if flashcards is not None:
+        logger.debug("Parsed %s flashcards", len(flashcards))
         
-        Text: {text[:8000]}"""
+        # Validate flashcards have required fields
+        valid_flashcards = []
+        for fc in flashcards:
+            if isinstance(fc, dict) and isinstance(fc.get('question'), str) and isinstance(fc.get('answer'), str):
+                if fc['question'].strip() and fc['answer'].strip():
+                    valid_flashcards.append(fc)
         
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        print(f"Error generating summary: {e}")
-        return "Error generating summary. Please try again."
+        logger.debug("Valid flashcards: %s", len(valid_flashcards))
+        return valid_flashcards[:num_cards]
+    
+    logger.warning("No valid JSON array found in flashcard response")
+    logger.debug("Full response (first 1000 chars): %s", response_text[:1000])
+    
+    # Try alternative extraction - look for individual flashcard objects
+    flashcards = [{'question': q, 'answer': a}
+                  for q, a in _QA_PAIR_RE.findall(response_text)[:num_cards]]
+    if flashcards:
+        logger.debug("Extracted %s flashcards using alternative method", len(flashcards))
+    return flashcards
+
+def parse_quiz(response_text, num_questions):
+    """Extract quiz question objects from a Gemini response, or []"""
+    quiz = extract_json_array(response_text)
+    if quiz is None:
+        return []
+    return [q for q in quiz if isinstance(q, dict)][:num_questions]
 
 def generate_flashcards(text, num_cards=5):
     """Generate flashcards using Gemini AI"""
-    print(f"\n--- generate_flashcards() called ---")
-    print(f"Text length: {len(text)} characters")
-    print(f"Number of cards requested: {num_cards}")
-    print(f"Model available: {model is not None}")
+    logger.debug("generate_flashcards: %s characters, %s cards requested, model available: %s",
+                 len(text), num_cards, model is not None)
     
     if not model:
-        print("ERROR: AI model not initialized")
+        logger.warning("AI model not initialized")
         return []
     
     try:
-        print("Creating prompt for AI...")
         prompt = f"""Create {num_cards} ULTRA-CONCISE revision flashcards for quick memorization.
 
 STRICT RULES:
@@ -365,90 +885,38 @@ BAD Examples (TOO LONG):
   {{"question": "Can you explain what supervised learning means?", "answer": "Supervised learning is a type of machine learning where the algorithm learns from labeled data, meaning each training example is paired with an output label."}}
 ]
 
-Text: {text[:8000]}
+Text: {text[:PROMPT_TEXT_CHARS]}
 
 Return ONLY the JSON array."""
         
-        print(f"Sending request to Gemini AI...")
-        print(f"Using model: {model._model_name if hasattr(model, '_model_name') else 'Unknown'}")
+        logger.debug("Sending request to Gemini AI (model: %s)", getattr(model, 'model_name', 'Unknown'))
         
         try:
-            response = model.generate_content(
+            response_text = generate_content_cached(
                 prompt,
                 generation_config={
                     'temperature': 0.7,
                     'max_output_tokens': 4096,  # Increased for more flashcards
-                }
+                },
+                is_valid=lambda t: bool(parse_flashcards(t.strip(), num_cards))
             )
-            print(f"✓ AI Response received successfully!")
-            print(f"Response type: {type(response)}")
+            logger.debug("AI response received")
             
             # Check if response has text
-            if not hasattr(response, 'text'):
-                print(f"ERROR: Response has no text attribute")
-                print(f"Response object: {dir(response)}")
+            if not response_text:
+                logger.warning("Gemini response has no text")
                 return []
             
-            response_text = response.text.strip()
-            print(f"Response text length: {len(response_text)} characters")
-            print(f"Response preview: {response_text[:200]}...")
+            response_text = response_text.strip()
+            logger.debug("Response text length: %s characters", len(response_text))
             
         except Exception as api_error:
-            print(f"ERROR calling Gemini API: {api_error}")
-            print(f"Error type: {type(api_error).__name__}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("Gemini API call for flashcards failed: %s", api_error)
             return []
         
-        # Extract JSON from response
-        print("Extracting JSON from response...")
-        
-        # Try to find complete JSON array
-        json_match = re.search(r'\[\s*{.*?}\s*\]', response_text, re.DOTALL)
-        
-        if json_match:
-            json_str = json_match.group()
-            print(f"JSON found. Length: {len(json_str)} characters")
-            try:
-                flashcards = json.loads(json_str)
-                print(f"Successfully parsed {len(flashcards)} flashcards")
-                
-                # Validate flashcards have required fields
-                valid_flashcards = []
-                for fc in flashcards:
-                    if 'question' in fc and 'answer' in fc:
-                        if fc['question'].strip() and fc['answer'].strip():
-                            valid_flashcards.append(fc)
-                
-                print(f"Valid flashcards: {len(valid_flashcards)}")
-                return valid_flashcards[:num_cards]
-            except json.JSONDecodeError as je:
-                print(f"JSON parsing error: {je}")
-                print(f"Attempted to parse: {json_str[:500]}...")
-                return []
-        else:
-            print("WARNING: No valid JSON array found in response")
-            print(f"Full response (first 1000 chars): {response_text[:1000]}")
-            
-            # Try alternative extraction - look for individual flashcard objects
-            try:
-                flashcards = []
-                # Find all question-answer pairs
-                pairs = re.findall(r'"question"\s*:\s*"([^"]+)"[^}]*"answer"\s*:\s*"([^"]+)"', response_text, re.DOTALL)
-                for q, a in pairs[:num_cards]:
-                    flashcards.append({'question': q, 'answer': a})
-                
-                if flashcards:
-                    print(f"Extracted {len(flashcards)} flashcards using alternative method")
-                    return flashcards
-            except Exception as e:
-                print(f"Alternative extraction failed: {e}")
-            
-            return []
+        return parse_flashcards(response_text, num_cards)
     except Exception as e:
-        print(f"EXCEPTION in generate_flashcards: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("generate_flashcards failed: %s", e)
         return []
 
 def generate_quiz(text, num_questions=5):
@@ -465,57 +933,201 @@ def generate_quiz(text, num_questions=5):
         
         Format your response as a JSON array with objects containing 'question', 'options' (array of 4 strings), and 'correct' (integer 0-3) fields.
         
-        Text: {text[:8000]}
+        Text: {text[:PROMPT_TEXT_CHARS]}
         
         Return ONLY the JSON array, no additional text."""
         
-        response = model.generate_content(prompt)
-        response_text = response.text.strip()
+        response_text = generate_content_cached(
+            prompt, is_valid=lambda t: bool(parse_quiz(t, num_questions))
+        ).strip()
         
-        # Extract JSON from response
-        json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-        if json_match:
-            quiz = json.loads(json_match.group())
-            return quiz[:num_questions]
-        else:
-            return []
+        return parse_quiz(response_text, num_questions)
     except Exception as e:
-        print(f"Error generating quiz: {e}")
+        logger.error("Error generating quiz: %s", e)
         return []
 
 def get_user_stats(user_id):
     """Get user statistics for dashboard"""
     conn = get_db()
     
-    # Count materials
-    materials_count = conn.execute('SELECT COUNT(*) FROM materials WHERE user_id = ?', (user_id,)).fetchone()[0]
+    # Material, flashcard and quiz counts plus average score in one round trip
+    row = conn.execute('''
+        SELECT
+            (SELECT COUNT(*) FROM materials WHERE user_id = ?) AS materials_count,
+            (SELECT COUNT(*) FROM flashcards f
+             JOIN materials m ON f.material_id = m.id
+             WHERE m.user_id = ?) AS flashcards_count,
+            (SELECT COUNT(*) FROM quiz_attempts WHERE user_id = ?) AS quiz_count,
+            (SELECT AVG(CAST(score AS FLOAT) / total_questions * 100)
+             FROM quiz_attempts
+             WHERE user_id = ?) AS avg_score
+    ''', (user_id,) * 4).fetchone()
+    avg_score = row['avg_score']
     
-    # Count flashcards
-    flashcards_count = conn.execute('''
-        SELECT COUNT(*) FROM flashcards f
-        JOIN materials m ON f.material_id = m.id
-        WHERE m.user_id = ?
-    ''', (user_id,)).fetchone()[0]
+    return {
+        'materials_count': row['materials_count'],
+        'flashcards_count': row['flashcards_count'],
+        'quiz_count': row['quiz_count'],
+        'avg_score': round(avg_score, 1) if avg_score else 0
+    }
+
+def compute_streak(days, today):
+    """Count consecutive days ending today, given distinct day ordinals in descending order"""
+    streak = 0
+    for day in days:
+        if day != today - streak:
+            break
+        streak += 1
+    return streak
+
+def generate_study_content(text):
+    """Run the independent summary, subject, flashcard and quiz Gemini calls concurrently"""
+    summary = _llm_executor.submit(generate_summary, text)
+    subject = _llm_executor.submit(detect_subject, text)
+    flashcards_data = _llm_executor.submit(generate_flashcards, text)
+    quiz_data = _llm_executor.submit(generate_quiz, text)
+    return summary.result(), subject.result(), flashcards_data.result(), quiz_data.result()
+
+def run_coalesced(key, func, *args):
+    """Call func(*args), or wait for the identical call already running under key"""
+    with _inflight_lock:
+        future = _inflight_generations.get(key)
+        is_owner = future is None
+        if is_owner:
+            future = _inflight_generations[key] = Future()
+    if not is_owner:
+        return future.result()
     
-    # Count quiz attempts
-    quiz_count = conn.execute('SELECT COUNT(*) FROM quiz_attempts WHERE user_id = ?', (user_id,)).fetchone()[0]
+    try:
+        result = func(*args)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        with _inflight_lock:
+            _inflight_generations.pop(key, None)
+
+def title_from_filename(filename):
+    """Generate a material title from an uploaded PDF's filename"""
+    return filename.replace('.pdf', '').replace('_', ' ').title()
+
+def generate_material_content(material_ids, text_content):
+    """Background job: generate and store the AI content for materials saved as 'processing'"""
+    try:
+        summary, subject, flashcards_data, quiz_data = generate_study_content(text_content)
+    except Exception as e:
+        logger.exception("Error generating content for materials %s: %s", material_ids, e)
+        summary, subject, flashcards_data, quiz_data = None, "General", [], []
     
-    # Calculate average score
-    avg_score = conn.execute('''
-        SELECT AVG(CAST(score AS FLOAT) / total_questions * 100) 
-        FROM quiz_attempts 
-        WHERE user_id = ?
-    ''', (user_id,)).fetchone()[0]
+    # Never store an error message as the summary; a 'failed' material keeps
+    # summary NULL and is not reused when the same file is uploaded again
+    if summary in (SUMMARY_UNAVAILABLE, SUMMARY_FAILED):
+        summary = None
+    status = 'ready' if summary and flashcards_data and quiz_data else 'failed'
     
-    conn.close()
+    # Save each duplicate separately so one material deleted mid-job (its
+    # card inserts would fail the foreign key) cannot roll back the others
+    conn = get_db()
+    for material_id in material_ids:
+        try:
+            with conn:
+                updated = conn.execute(
+                    'UPDATE materials SET summary = ?, subject = ?, generation_status = ? WHERE id = ?',
+                    (summary, subject, status, material_id)).rowcount
+                if updated:
+                    insert_study_cards(conn, material_id, flashcards_data, quiz_data)
+        except Exception as e:
+            logger.exception("Error saving content for material %s: %s", material_id, e)
+            with conn:
+                conn.execute("UPDATE materials SET generation_status = 'failed' WHERE id = ?", (material_id,))
+
+def generate_and_save_flashcards(material_id, text_content, num_cards):
+    """Job body: generate a material's flashcards and replace the stored set"""
+    logger.debug("Calling AI to generate flashcards (model available: %s)", model is not None)
+    flashcards_data = run_coalesced(('flashcards', material_id, num_cards),
+                                    generate_flashcards, text_content, num_cards)
+    logger.debug("AI returned %s flashcards", len(flashcards_data) if flashcards_data else 0)
+    
+    if not flashcards_data:
+        logger.warning("No flashcards generated by AI for material %s", material_id)
+        return {'success': False, 'error': 'Failed to generate flashcards'}
+    
+    conn = get_db()
+    with conn:
+        logger.debug("Replacing flashcards for material %s with %s new cards", material_id, len(flashcards_data))
+        conn.execute(SQL_DELETE_FLASHCARDS, (material_id,))
+        conn.executemany(SQL_INSERT_FLASHCARD,
+                         [(material_id, fc.get('question', ''), fc.get('answer', '')) for fc in flashcards_data])
     
     return {
-        'materials_count': materials_count,
-        'flashcards_count': flashcards_count,
-        'quiz_count': quiz_count,
-        'avg_score': round(avg_score, 1) if avg_score else 0
+        'success': True,
+        'flashcards': flashcards_data,
+        'message': f'{len(flashcards_data)} flashcards generated successfully'
+    }
+
+def generate_and_save_quiz(material_id, text_content, num_questions):
+    """Job body: generate a material's quiz questions and replace the stored set"""
+    quiz_data = run_coalesced(('quiz', material_id, num_questions),
+                              generate_quiz, text_content, num_questions)
+    
+    if not quiz_data:
+        return {'success': False, 'error': 'Failed to generate quiz questions'}
+    
+    conn = get_db()
+    with conn:
+        logger.debug("Replacing quiz for material %s with %s new questions", material_id, len(quiz_data))
+        conn.execute(SQL_DELETE_QUIZZES, (material_id,))
+        conn.executemany(SQL_INSERT_QUIZ,
+                         [(material_id, q.get('question', ''), orjson.dumps(q.get('options', [])).decode(), q.get('correct', 0))
+                          for q in quiz_data])
+    
+    return {
+        'success': True,
+        'quiz': quiz_data,
+        'message': f'{len(quiz_data)} quiz questions generated successfully'
     }
 
+def run_generation_job(job_id, func, *args):
+    """Background job: run a generation and store its JSON response on the job row"""
+    try:
+        result = func(*args)
+    except Exception as e:
+        logger.exception("Generation job %s failed", job_id)
+        result = {'success': False, 'error': str(e)}
+    
+    # Store the finished response fully serialized so /job/<job_id> can send it as-is
+    result['status'] = 'done' if result.get('success') else 'failed'
+    conn = get_db()
+    with conn:
+        conn.execute('UPDATE jobs SET status = ?, result = ? WHERE id = ?',
+                     (result['status'], orjson.dumps(result).decode(), job_id))
+
+def submit_generation_job(conn, user_id, func, *args):
+    """Record a pending job, queue it on the generation executor and return its id"""
+    job_id = uuid.uuid4().hex
+    with conn:
+        conn.execute("DELETE FROM jobs WHERE created_at < datetime('now', '-1 day')")
+        conn.execute('INSERT INTO jobs (id, user_id) VALUES (?, ?)', (job_id, user_id))
+    _generation_executor.submit(run_generation_job, job_id, func, *args)
+    return job_id
+
+def iter_json_object(fields):
+    """Yield a JSON object as byte chunks, encoding list values one element at a time"""
+    yield b'{'
+    for i, (key, value) in enumerate(fields):
+        yield (b',' if i else b'') + orjson.dumps(key) + b':'
+        if isinstance(value, list):
+            yield b'['
+            for j, item in enumerate(value):
+                yield (b',' if j else b'') + orjson.dumps(item)
+            yield b']'
+        else:
+            yield orjson.dumps(value)
+    yield b'}'
+
 # Routes
 @app.route('/')
 def home():
@@ -546,39 +1158,20 @@ def login():
         conn = get_db()
         cursor = conn.execute('SELECT id, name, email, password FROM users WHERE email = ?', (email,))
         user = cursor.fetchone()
-        conn.close()
         
-        if user:
-            # Access Row object fields by column name
-            user_password = user[3]  # password is the 4th column (index 3)
-            print(f"Login attempt for: {email}")
-            print(f"Input password: {password}")
-            print(f"Password hash type: {type(user_password)}")
-            print(f"Password hash from DB: {user_password[:50] if len(user_password) > 50 else user_password}")
-            print(f"Password hash length: {len(user_password)}")
-            
-            # Try password verification
-            verification_result = check_password_hash(user_password, password)
-            print(f"Password check result: {verification_result}")
-            
-            if verification_result:
-                session['user_id'] = user[0]  # id
-                session['user_name'] = user[1]  # name
-                session['user_email'] = user[2]  # email
-                session['logged_in'] = True
-                flash('Successfully logged in!', 'success')
-                return redirect(url_for('dashboard'))
-            else:
-                print("Password check failed - hash verification returned False")
-        else:
-            print(f"No user found with email: {email}")
+        # password is the 4th column (index 3)
+        if user and verify_password(user[3], password):
+            session['user_id'] = user[0]  # id
+            session['user_name'] = user[1]  # name
+            session['user_email'] = user[2]  # email
+            session['logged_in'] = True
+            flash('Successfully logged in!', 'success')
+            return redirect(url_for('dashboard'))
         
         flash('Invalid email or password', 'error')
         return redirect(url_for('signin'))
     except Exception as e:
-        print(f"Login error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Login error: %s", e)
         flash('An error occurred during login. Please try again.', 'error')
         return redirect(url_for('signin'))
 
@@ -599,14 +1192,11 @@ def register():
         # Check if user already exists
         existing = conn.execute('SELECT id FROM users WHERE email = ?', (email,)).fetchone()
         if existing:
-            conn.close()
             flash('Email already registered', 'error')
             return redirect(url_for('signup'))
         
         # Create new user
         hashed_password = generate_password_hash(password)
-        print(f"Registration: Hashing password for {email}")
-        print(f"Generated hash: {hashed_password[:20]}...")
         
         cursor = conn.execute('INSERT INTO users (name, email, password) VALUES (?, ?, ?)',
                      (name, email, hashed_password))
@@ -614,9 +1204,8 @@ def register():
         
         # Get the last inserted user ID
         user_id = cursor.lastrowid
-        conn.close()
         
-        print(f"User registered successfully with ID: {user_id}")
+        logger.info("User registered successfully with ID: %s", user_id)
         
         # Log in the new user
         session['user_id'] = user_id
@@ -626,9 +1215,7 @@ def register():
         flash('Account created successfully!', 'success')
         return redirect(url_for('dashboard'))
     except Exception as e:
-        print(f"Registration error: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Registration error: %s", e)
         flash('An error occurred during registration. Please try again.', 'error')
         return redirect(url_for('signup'))
 
@@ -649,7 +1236,6 @@ def dashboard():
         WHERE user_id = ? 
         ORDER BY created_at DESC
     ''', (user_id,)).fetchall()
-    conn.close()
     
     return render_template('dashboard.html', user_name=user_name, materials=materials)
 
@@ -670,12 +1256,7 @@ def study_material(material_id):
     ''', (material_id, user_id)).fetchone()
     
     # Track activity
-    conn.execute('''
-        INSERT INTO user_activity (user_id, material_id, activity_type)
-        VALUES (?, ?, ?)
-    ''', (user_id, material_id, 'view_material'))
-    conn.commit()
-    conn.close()
+    log_activity(user_id, material_id, 'view_material')
     
     if not material:
         flash('Material not found', 'error')
@@ -705,12 +1286,7 @@ def flashcards(material_id):
     ''', (material_id,)).fetchall()
     
     # Track activity
-    conn.execute('''
-        INSERT INTO user_activity (user_id, material_id, activity_type)
-        VALUES (?, ?, ?)
-    ''', (user_id, material_id, 'flashcards'))
-    conn.commit()
-    conn.close()
+    log_activity(user_id, material_id, 'flashcards')
     
     if not material:
         flash('Material not found', 'error')
@@ -744,12 +1320,7 @@ def quiz(material_id):
     ''', (material_id,)).fetchall()
     
     # Track activity (Note: quiz completion is tracked in submit_quiz)
-    conn.execute('''
-        INSERT INTO user_activity (user_id, material_id, activity_type)
-        VALUES (?, ?, ?)
-    ''', (user_id, material_id, 'start_quiz'))
-    conn.commit()
-    conn.close()
+    log_activity(user_id, material_id, 'start_quiz')
     
     if not material:
         flash('Material not found', 'error')
@@ -771,7 +1342,8 @@ def growth_dashboard():
     user_id = session.get('user_id')
     user_name = session.get('user_name', 'User')
     
-    # Get user statistics and activity
+    # Get user statistics and activity, including any still-buffered page views
+    flush_activity()
     conn = get_db()
     
     # Weekly activity (last 30 days for better visualization)
@@ -806,26 +1378,16 @@ def growth_dashboard():
     ''', (user_id,)).fetchall()
     subject_dist = [dict(row) for row in subject_dist_raw]
     
-    # Study streak (consecutive days with activity)
-    recent_activity = conn.execute('''
-        SELECT DISTINCT DATE(created_at) as date
+    # Study streak (consecutive days with activity), with days as proleptic
+    # Gregorian ordinals (same numbering as date.toordinal()) so no parsing is needed
+    recent_days = conn.execute('''
+        SELECT DISTINCT CAST(julianday(DATE(created_at)) - 1721424.5 AS INTEGER) as day
         FROM user_activity
         WHERE user_id = ?
-        ORDER BY date DESC
+        ORDER BY day DESC
         LIMIT 30
     ''', (user_id,)).fetchall()
-    
-    # Calculate streak
-    streak = 0
-    if recent_activity:
-        today = datetime.now().date()
-        for activity in recent_activity:
-            activity_date = datetime.strptime(activity['date'], '%Y-%m-%d').date()
-            expected_date = today - timedelta(days=streak)
-            if activity_date == expected_date:
-                streak += 1
-            else:
-                break
+    streak = compute_streak([row[0] for row in recent_days], datetime.now().date().toordinal())
     
     # Activity breakdown by type
     activity_breakdown_raw = conn.execute('''
@@ -846,8 +1408,6 @@ def growth_dashboard():
     ''', (user_id, thirty_days_ago)).fetchall()
     materials_timeline = [dict(row) for row in materials_timeline_raw]
     
-    conn.close()
-    
     stats = get_user_stats(user_id)
     stats['streak'] = streak
     
@@ -873,6 +1433,7 @@ def upload_document():
     
     files = request.files.getlist('files')
     uploaded_materials = []
+    received_files = []
     
     for file in files:
         if file.filename == '':
@@ -880,69 +1441,76 @@ def upload_document():
         
         if file and file.filename.endswith('.pdf'):
             try:
-                # Save file
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"{timestamp}_{file.filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-        
-                # Extract text
-                text_content = extract_text_from_pdf(filepath)
-                if not text_content:
-                    continue
-                
-                # Generate title from filename
-                title = file.filename.replace('.pdf', '').replace('_', ' ').title()
-                
-                # Generate summary
-                summary = generate_summary(text_content)
-                
-                # Detect subject from content
-                subject = detect_subject(text_content)
-                
-                # Save to database
-                conn = get_db()
-                cursor = conn.execute('''
-                    INSERT INTO materials (user_id, title, subject, file_type, file_path, text_content, summary)
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (user_id, title, subject, 'pdf', filepath, text_content, summary))
-                material_id = cursor.lastrowid
-                
-                # Generate flashcards
-                flashcards_data = generate_flashcards(text_content)
-                for fc in flashcards_data:
-                    conn.execute('''
-                        INSERT INTO flashcards (material_id, question, answer)
-                        VALUES (?, ?, ?)
-                    ''', (material_id, fc.get('question', ''), fc.get('answer', '')))
-                
-                # Generate quiz questions
-                quiz_data = generate_quiz(text_content)
-                for q in quiz_data:
-                    conn.execute('''
-                        INSERT INTO quizzes (material_id, question, options, correct_answer)
-                        VALUES (?, ?, ?, ?)
-                    ''', (material_id, q.get('question', ''), json.dumps(q.get('options', [])), q.get('correct', 0)))
-                
-                # Log activity
-                conn.execute('''
-                    INSERT INTO user_activity (user_id, material_id, activity_type)
-                    VALUES (?, ?, ?)
-                ''', (user_id, material_id, 'upload'))
-                
-                conn.commit()
-                conn.close()
-                
-                uploaded_materials.append({
-                    'id': material_id,
-                    'title': title,
-                    'subject': subject
-                })
-                
+                data = file.read()
+                received_files.append((file.filename, data, hashlib.sha256(data).hexdigest()))
             except Exception as e:
-                print(f"Error processing file {file.filename}: {e}")
+                logger.error("Error reading file %s: %s", file.filename, e)
                 continue
     
+    # Files whose content was processed before (or repeats within this
+    # upload) reuse that text and AI content instead of running the pipeline
+    conn = get_db()
+    results_by_hash = {}
+    pending = []
+    for original_filename, data, content_sha256 in received_files:
+        if content_sha256 not in results_by_hash:
+            results_by_hash[content_sha256] = load_material_by_hash(conn, content_sha256)
+            if results_by_hash[content_sha256] is None:
+                pending.append((original_filename, data, content_sha256))
+    
+    # Parse the PDFs straight from the uploaded bytes in worker processes (CPU-bound)
+    texts_by_hash = {}
+    if pending:
+        try:
+            texts = extract_texts_from_pdfs([data for _, data, _ in pending])
+        except Exception as e:
+            logger.error("Error extracting text from PDFs: %s", e)
+            texts = [None] * len(pending)
+        texts_by_hash = {content_sha256: text for (_, _, content_sha256), text in zip(pending, texts)}
+    
+    # Save files that produced a material to disk and to the database. New
+    # content is saved with summary NULL and its AI content is generated in
+    # the background; poll /material/<id>/status for progress.
+    new_materials_by_hash = {}
+    for original_filename, data, content_sha256 in received_files:
+        result = results_by_hash[content_sha256]
+        text_content = texts_by_hash.get(content_sha256)
+        if result is None and not text_content:
+            continue
+        
+        if result is not None:
+            material, flashcards_data, quiz_data = result
+        else:
+            material, flashcards_data, quiz_data = {
+                'subject': None,
+                'file_type': 'pdf',
+                'text_content': text_content,
+                'summary': None,
+                'generation_status': 'processing'
+            }, [], []
+        try:
+            material = dict(material,
+                            title=title_from_filename(original_filename),
+                            file_path=save_upload(original_filename, data),
+                            content_sha256=content_sha256)
+            material_id = save_material(conn, user_id, material, flashcards_data, quiz_data, 'upload')
+        except Exception as e:
+            logger.error("Error saving material %s: %s", original_filename, e)
+            continue
+        
+        if result is None:
+            new_materials_by_hash.setdefault(content_sha256, []).append(material_id)
+        uploaded_materials.append({
+            'id': material_id,
+            'title': material['title'],
+            'subject': material['subject'],
+            'status': 'ready' if result is not None else 'processing'
+        })
+    
+    # Identical files share one generation job
+    for content_sha256, material_ids in new_materials_by_hash.items():
+        _generation_executor.submit(generate_material_content, material_ids, texts_by_hash[content_sha256])
+    
     if uploaded_materials:
         return jsonify({
             'success': True,
@@ -952,6 +1520,41 @@ def upload_document():
     else:
         return jsonify({'error': 'Failed to process files'}), 400
 
+@app.route('/material/<int:material_id>/status')
+def material_status(material_id):
+    """Report whether a material's background AI generation has finished"""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    conn = get_db()
+    material = conn.execute('''
+        SELECT generation_status,
+               created_at < datetime('now', ?) AS is_stale,
+               summary IS NOT NULL AS has_summary,
+               (SELECT COUNT(*) FROM flashcards WHERE material_id = materials.id) AS flashcards,
+               (SELECT COUNT(*) FROM quizzes WHERE material_id = materials.id) AS quiz
+        FROM materials
+        WHERE id = ? AND user_id = ?
+    ''', (f'-{GENERATION_TIMEOUT_SECONDS} seconds', material_id, session.get('user_id'))).fetchone()
+    
+    if not material:
+        return jsonify({'error': 'Material not found'}), 404
+    
+    status = material['generation_status']
+    if status == 'processing' and material['is_stale']:
+        # The job was lost (e.g. its worker restarted); stop clients polling forever
+        status = 'failed'
+        with conn:
+            conn.execute("UPDATE materials SET generation_status = 'failed' WHERE id = ?", (material_id,))
+    
+    return jsonify({
+        'success': True,
+        'status': status,
+        'summary': bool(material['has_summary']),
+        'flashcards': material['flashcards'],
+        'quiz': material['quiz']
+    })
+
 @app.route('/upload_mixed', methods=['POST'])
 def upload_mixed():
     """Create one study set from multiple PDFs and YouTube URLs."""
@@ -976,21 +1579,20 @@ def upload_mixed():
         return jsonify({'error': 'No inputs provided'}), 400
 
     full_text = ""
-    subjects = []
     components = []
 
-    # Process PDFs
-    for file in files:
-        if file.filename and file.filename.endswith('.pdf'):
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{timestamp}_{file.filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            text = extract_text_from_pdf(filepath) or ''
-            if text:
-                full_text += ("\n\n" + text)
-                subjects.append(detect_subject(text))
-                components.append({'type': 'pdf', 'path': filepath})
+    # Process PDFs, parsing them from memory and keeping only those with text
+    pdfs = [(file.filename, file.read()) for file in files
+            if file.filename and file.filename.endswith('.pdf')]
+    try:
+        texts = extract_texts_from_pdfs([data for _, data in pdfs])
+    except Exception as e:
+        logger.error("Error extracting text from PDFs: %s", e)
+        texts = [None] * len(pdfs)
+    for (original_filename, data), text in zip(pdfs, texts):
+        if text:
+            full_text += ("\n\n" + text)
+            components.append({'type': 'pdf', 'path': save_upload(original_filename, data)})
 
     # Process YouTube URLs
     for u in urls:
@@ -1000,39 +1602,26 @@ def upload_mixed():
         transcript = get_youtube_transcript(u) or ''
         if transcript:
             full_text += ("\n\n" + transcript)
-            subjects.append(detect_subject(transcript))
             components.append({'type': 'youtube', 'url': f'https://www.youtube.com/watch?v={vid}'})
 
     if not full_text.strip():
         return jsonify({'error': 'Failed to extract content from inputs'}), 400
 
-    # Title and subject
-    dominant_subject = next((s for s in subjects if s and s != 'General'), None) or 'General'
+    # Generate summary, subject, flashcards and quiz questions for the combined set
+    summary, dominant_subject, flashcards_data, quiz_data = generate_study_content(full_text)
+    dominant_subject = dominant_subject or 'General'
     title = set_title or (dominant_subject if dominant_subject != 'General' else 'Study Set')
 
-    # Generate AI artifacts
-    summary = generate_summary(full_text)
-    flashcards_data = generate_flashcards(full_text)
-    quiz_data = generate_quiz(full_text)
-
     # Save to DB
     conn = get_db()
-    cursor = conn.execute('''
-        INSERT INTO materials (user_id, title, subject, file_type, file_path, text_content, summary)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    ''', (user_id, title, dominant_subject, 'mixed', json.dumps(components), full_text, summary))
-    material_id = cursor.lastrowid
-
-    for fc in flashcards_data:
-        conn.execute('INSERT INTO flashcards (material_id, question, answer) VALUES (?, ?, ?)',
-                     (material_id, fc.get('question', ''), fc.get('answer', '')))
-    for q in quiz_data:
-        conn.execute('INSERT INTO quizzes (material_id, question, options, correct_answer) VALUES (?, ?, ?, ?)',
-                     (material_id, q.get('question', ''), json.dumps(q.get('options', [])), q.get('correct', 0)))
-    conn.execute('INSERT INTO user_activity (user_id, material_id, activity_type) VALUES (?, ?, ?)',
-                 (user_id, material_id, 'upload_mixed'))
-    conn.commit()
-    conn.close()
+    material_id = save_material(conn, user_id, {
+        'title': title,
+        'subject': dominant_subject,
+        'file_type': 'mixed',
+        'file_path': json.dumps(components),
+        'text_content': full_text,
+        'summary': summary
+    }, flashcards_data, quiz_data, 'upload_mixed')
 
     return jsonify({'success': True, 'message': 'Study set created successfully', 'materials': [{'id': material_id, 'title': title, 'subject': dominant_subject}]})
 
@@ -1060,47 +1649,24 @@ def add_youtube_url():
         if not transcript:
             return jsonify({'error': 'Could not extract transcript from this video. The video might not have captions available.'}), 400
 
-        # Detect subject/topic and set a meaningful title
-        subject = detect_subject(transcript)
+        # Generate summary, subject, flashcards and quiz questions
+        summary, subject, flashcards_data, quiz_data = generate_study_content(transcript)
+
+        # Use the detected subject/topic as a meaningful title
         detected_topic = subject if subject and subject != "General" else None
         # Fallback to YouTube title placeholder if topic uncertain
         title = detected_topic or get_video_title(video_id)
 
-        # Generate summary
-        summary = generate_summary(transcript)
-
         # Save to database
         conn = get_db()
-        cursor = conn.execute('''
-            INSERT INTO materials (user_id, title, subject, file_type, file_path, text_content, summary)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, title, subject, 'youtube', f'https://www.youtube.com/watch?v={video_id}', transcript, summary))
-        material_id = cursor.lastrowid
-
-        # Generate flashcards
-        flashcards_data = generate_flashcards(transcript)
-        for fc in flashcards_data:
-            conn.execute('''
-                INSERT INTO flashcards (material_id, question, answer)
-                VALUES (?, ?, ?)
-            ''', (material_id, fc.get('question', ''), fc.get('answer', '')))
-
-        # Generate quiz questions
-        quiz_data = generate_quiz(transcript)
-        for q in quiz_data:
-            conn.execute('''
-                INSERT INTO quizzes (material_id, question, options, correct_answer)
-                VALUES (?, ?, ?, ?)
-            ''', (material_id, q.get('question', ''), json.dumps(q.get('options', [])), q.get('correct', 0)))
-
-        # Log activity
-        conn.execute('''
-            INSERT INTO user_activity (user_id, material_id, activity_type)
-            VALUES (?, ?, ?)
-        ''', (user_id, material_id, 'url_upload'))
-
-        conn.commit()
-        conn.close()
+        material_id = save_material(conn, user_id, {
+            'title': title,
+            'subject': subject,
+            'file_type': 'youtube',
+            'file_path': f'https://www.youtube.com/watch?v={video_id}',
+            'text_content': transcript,
+            'summary': summary
+        }, flashcards_data, quiz_data, 'url_upload')
 
         return jsonify({
             'success': True,
@@ -1114,13 +1680,29 @@ def add_youtube_url():
         })
 
     except Exception as e:
-        print(f"Error processing YouTube URL: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error processing YouTube URL: %s", e)
         return jsonify({'error': 'Failed to process YouTube video. Please try again.'}), 500
 
+def classify_subject_locally(text):
+    """Return a subject from keyword counts when one clearly dominates, else None"""
+    scores = {}
+    for match in _SUBJECT_KEYWORD_RE.finditer(text[:4000].lower()):
+        subject = _SUBJECT_BY_KEYWORD[match.group()]
+        scores[subject] = scores.get(subject, 0) + 1
+    
+    ranked = sorted(scores.values(), reverse=True)
+    if not ranked or ranked[0] < SUBJECT_MIN_HITS:
+        return None
+    if len(ranked) > 1 and ranked[0] < ranked[1] * SUBJECT_CONFIDENCE_RATIO:
+        return None
+    return max(scores, key=scores.get)
+
 def detect_subject(text):
-    """Detect subject from text content using AI"""
+    """Detect subject from text content, asking the AI only when keywords are inconclusive"""
+    subject = classify_subject_locally(text)
+    if subject:
+        return subject
+    
     if not model:
         return "General"
     
@@ -1132,8 +1714,7 @@ def detect_subject(text):
         
         Return ONLY the subject name, nothing else."""
         
-        response = model.generate_content(prompt)
-        subject = response.text.strip()
+        subject = generate_content_cached(prompt, is_valid=lambda t: len(t.strip()) < 50).strip()
         return subject if len(subject) < 50 else "General"
     except:
         return "General"
@@ -1149,19 +1730,42 @@ def generate_summary_route():
     difficulty = data.get('difficulty', 'standard')
     
     conn = get_db()
-    material = conn.execute('SELECT text_content FROM materials WHERE id = ?', (material_id,)).fetchone()
-    conn.close()
+    material = conn.execute(SQL_GET_MATERIAL_TEXT, (PROMPT_TEXT_CHARS, material_id)).fetchone()
     
     if not material:
         return jsonify({'error': 'Material not found'}), 404
     
+    if data.get('stream'):
+        # Send the summary as plain text while Gemini is still generating it
+        def generate():
+            parts = []
+            try:
+                for chunk in stream_summary(material['text_content'], difficulty):
+                    parts.append(chunk)
+                    yield chunk
+            except Exception as e:
+                logger.error("Error generating summary: %s", e)
+                yield "\n\nError generating summary. Please try again."
+                return
+            
+            # An empty stream leaves the stored summary untouched
+            if not parts:
+                logger.warning("Empty summary stream for material %s", material_id)
+                yield SUMMARY_FAILED
+                return
+            
+            # Update summary in database
+            conn = get_db()
+            conn.execute('UPDATE materials SET summary = ? WHERE id = ?', ("".join(parts), material_id))
+            conn.commit()
+        
+        return Response(stream_with_context(generate()), mimetype='text/plain')
+    
     summary = generate_summary(material['text_content'], difficulty)
     
     # Update summary in database
-    conn = get_db()
     conn.execute('UPDATE materials SET summary = ? WHERE id = ?', (summary, material_id))
     conn.commit()
-    conn.close()
     
     return jsonify({
         'success': True,
@@ -1170,89 +1774,52 @@ def generate_summary_route():
 
 @app.route('/generate_flashcards_for_material', methods=['POST'])
 def generate_flashcards_for_material():
-    """Generate flashcards on-demand for a material"""
-    print("\n" + "="*80)
-    print("FLASHCARD GENERATION REQUEST RECEIVED")
-    print("="*80)
+    """Queue on-demand flashcard generation for a material; poll /job/<job_id> for the result"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("=" * 80)
+        logger.debug("FLASHCARD GENERATION REQUEST RECEIVED")
     
     if not session.get('logged_in'):
-        print("ERROR: User not authenticated")
+        logger.debug("User not authenticated")
         return jsonify({'error': 'Not authenticated'}), 401
     
     data = request.json
     material_id = data.get('material_id')
     num_cards = data.get('num_cards', 10)  # Default to 10 if not specified
-    print(f"Material ID: {material_id}")
-    print(f"Number of cards requested: {num_cards}")
+    logger.debug("Material ID: %s", material_id)
+    logger.debug("Number of cards requested: %s", num_cards)
     
     if not material_id:
-        print("ERROR: No material ID provided")
+        logger.debug("No material ID provided")
         return jsonify({'error': 'Material ID required'}), 400
     
     try:
-        print("Connecting to database...")
         conn = get_db()
         
         # Get material text content
-        print(f"Fetching material {material_id} from database...")
-        material = conn.execute('SELECT text_content FROM materials WHERE id = ?', (material_id,)).fetchone()
+        logger.debug("Fetching material %s from database", material_id)
+        material = conn.execute(SQL_GET_USER_MATERIAL_TEXT,
+                                (PROMPT_TEXT_CHARS, material_id, session.get('user_id'))).fetchone()
         
         if not material:
-            print(f"ERROR: Material {material_id} not found in database")
-            conn.close()
+            logger.debug("Material %s not found in database", material_id)
             return jsonify({'error': 'Material not found'}), 404
         
         text_content = material[0]
-        print(f"Material found. Text length: {len(text_content)} characters")
+        logger.debug("Material found. Text length: %s characters", len(text_content))
         
-        # Generate flashcards
-        print("Calling AI to generate flashcards...")
-        print(f"AI Model available: {model is not None}")
+        job_id = submit_generation_job(conn, session.get('user_id'), generate_and_save_flashcards,
+                                       material_id, text_content, num_cards)
         
-        flashcards_data = generate_flashcards(text_content, num_cards=num_cards)
-        
-        print(f"AI returned {len(flashcards_data) if flashcards_data else 0} flashcards")
-        
-        if not flashcards_data:
-            print("ERROR: No flashcards generated by AI")
-            conn.close()
-            return jsonify({'error': 'Failed to generate flashcards'}), 500
-        
-        # Delete existing flashcards for this material
-        print(f"Deleting existing flashcards for material {material_id}...")
-        conn.execute('DELETE FROM flashcards WHERE material_id = ?', (material_id,))
-        
-        # Save new flashcards to database
-        print(f"Saving {len(flashcards_data)} new flashcards to database...")
-        for idx, fc in enumerate(flashcards_data):
-            print(f"  Saving flashcard {idx+1}: {fc.get('question', 'N/A')[:50]}...")
-            conn.execute('''
-                INSERT INTO flashcards (material_id, question, answer)
-                VALUES (?, ?, ?)
-            ''', (material_id, fc.get('question', ''), fc.get('answer', '')))
-        
-        conn.commit()
-        conn.close()
-        
-        print(f"SUCCESS: {len(flashcards_data)} flashcards saved successfully!")
-        print("="*80 + "\n")
-        
-        return jsonify({
-            'success': True,
-            'flashcards': flashcards_data,
-            'message': f'{len(flashcards_data)} flashcards generated successfully'
-        })
+        return jsonify({'success': True, 'status': 'pending', 'job_id': job_id}), 202
         
     except Exception as e:
-        print(f"EXCEPTION in generate_flashcards_for_material: {e}")
-        import traceback
-        traceback.print_exc()
-        print("="*80 + "\n")
+        logger.exception("generate_flashcards_for_material failed for material %s", material_id)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/generate_quiz_for_material', methods=['POST'])
 def generate_quiz_for_material():
-    """Generate quiz questions on-demand for a material"""
+    """Queue on-demand quiz generation for a material; poll /job/<job_id> for the result"""
     if not session.get('logged_in'):
         return jsonify({'error': 'Not authenticated'}), 401
     
@@ -1267,44 +1834,99 @@ def generate_quiz_for_material():
         conn = get_db()
         
         # Get material text content
-        material = conn.execute('SELECT text_content FROM materials WHERE id = ?', (material_id,)).fetchone()
+        material = conn.execute(SQL_GET_USER_MATERIAL_TEXT,
+                                (PROMPT_TEXT_CHARS, material_id, session.get('user_id'))).fetchone()
         
         if not material:
-            conn.close()
             return jsonify({'error': 'Material not found'}), 404
         
-        text_content = material[0]
+        job_id = submit_generation_job(conn, session.get('user_id'), generate_and_save_quiz,
+                                       material_id, material[0], num_questions)
+        
+        return jsonify({'success': True, 'status': 'pending', 'job_id': job_id}), 202
+        
+    except Exception as e:
+        logger.error("Error queueing quiz generation for material %s: %s", material_id, e)
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/job/<job_id>')
+def job_status(job_id):
+    """Report a generation job's status, with its response once it has finished"""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    conn = get_db()
+    job = conn.execute('''
+        SELECT status, result, created_at < datetime('now', ?) AS is_stale
+        FROM jobs WHERE id = ? AND user_id = ?
+    ''', (f'-{JOB_TIMEOUT_SECONDS} seconds', job_id, session.get('user_id'))).fetchone()
+    
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    if job['result'] is None and job['is_stale']:
+        # The job was lost (e.g. its gunicorn worker restarted); fail it so clients stop polling
+        result = orjson.dumps({'success': False, 'error': 'Generation timed out. Please try again.',
+                               'status': 'failed'}).decode()
+        with conn:
+            conn.execute("UPDATE jobs SET status = 'failed', result = ? WHERE id = ? AND result IS NULL",
+                         (result, job_id))
+        return app.response_class(result, mimetype='application/json')
+    
+    if job['result'] is None:
+        return jsonify({'success': True, 'status': job['status']})
+    
+    return app.response_class(job['result'], mimetype='application/json')
+
+@app.route('/generate_study_pack_for_material', methods=['POST'])
+def generate_study_pack_for_material():
+    """Generate flashcards and quiz questions for a material with concurrent Gemini calls"""
+    if not session.get('logged_in'):
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    data = request.json
+    material_id = data.get('material_id')
+    num_cards = data.get('num_cards', 10)
+    num_questions = data.get('num_questions', 10)
+    
+    if not material_id:
+        return jsonify({'error': 'Material ID required'}), 400
+    
+    try:
+        conn = get_db()
+        material = conn.execute(SQL_GET_USER_MATERIAL_TEXT,
+                                (PROMPT_TEXT_CHARS, material_id, session.get('user_id'))).fetchone()
         
-        # Generate quiz questions
-        quiz_data = generate_quiz(text_content, num_questions=num_questions)
+        if not material:
+            return jsonify({'error': 'Material not found'}), 404
         
-        if not quiz_data:
-            conn.close()
-            return jsonify({'error': 'Failed to generate quiz questions'}), 500
+        text_content = material[0]
         
-        # Delete existing quiz questions for this material
-        print(f"Deleting existing quiz questions for material {material_id}...")
-        conn.execute('DELETE FROM quizzes WHERE material_id = ?', (material_id,))
+        flashcards_future = _llm_executor.submit(run_coalesced, ('flashcards', material_id, num_cards),
+                                                 generate_flashcards, text_content, num_cards)
+        quiz_future = _llm_executor.submit(run_coalesced, ('quiz', material_id, num_questions),
+                                           generate_quiz, text_content, num_questions)
+        flashcards_data, quiz_data = flashcards_future.result(), quiz_future.result()
         
-        # Save new quiz questions to database
-        print(f"Saving {len(quiz_data)} new quiz questions to database...")
-        for q in quiz_data:
-            conn.execute('''
-                INSERT INTO quizzes (material_id, question, options, correct_answer)
-                VALUES (?, ?, ?, ?)
-            ''', (material_id, q.get('question', ''), json.dumps(q.get('options', [])), q.get('correct', 0)))
+        if not flashcards_data or not quiz_data:
+            return jsonify({'error': 'Failed to generate study pack'}), 500
         
-        conn.commit()
-        conn.close()
+        # Replace both sets in one transaction
+        with conn:
+            conn.execute(SQL_DELETE_FLASHCARDS, (material_id,))
+            conn.execute(SQL_DELETE_QUIZZES, (material_id,))
+            insert_study_cards(conn, material_id, flashcards_data, quiz_data)
         
-        return jsonify({
-            'success': True,
-            'quiz': quiz_data,
-            'message': f'{len(quiz_data)} quiz questions generated successfully'
-        })
+        # Stream the (potentially large) card lists so sending starts before encoding finishes
+        return Response(stream_with_context(iter_json_object([
+            ('success', True),
+            ('flashcards', flashcards_data),
+            ('quiz', quiz_data),
+            ('message', f'{len(flashcards_data)} flashcards and {len(quiz_data)} quiz questions generated successfully')
+        ])), mimetype='application/json')
         
     except Exception as e:
-        print(f"Error generating quiz: {e}")
+        logger.error("Error generating study pack for material %s: %s", material_id, e)
         return jsonify({'error': str(e)}), 500
 
 @app.route('/submit_quiz', methods=['POST'])
@@ -1317,20 +1939,33 @@ def submit_quiz():
     data = request.json
     material_id = data.get('material_id')
     answers = data.get('answers', {})
+    if not isinstance(answers, dict):
+        return jsonify({'error': 'Answers must be an object keyed by question id'}), 400
     
-    conn = get_db()
-    quiz_questions = conn.execute('''
-        SELECT id, correct_answer FROM quizzes WHERE material_id = ?
-    ''', (material_id,)).fetchall()
+    # Unanswered (null) questions score nothing; anything else must be an option index
+    option_by_question = {}
+    for question_id, answer in answers.items():
+        if answer is None:
+            continue
+        try:
+            option_by_question[str(question_id)] = int(answer)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid answer for question ' + str(question_id)}), 400
     
-    # Calculate score
-    correct = 0
-    for q in quiz_questions:
-        user_answer = answers.get(str(q['id']))
-        if user_answer is not None and int(user_answer) == q['correct_answer']:
-            correct += 1
+    conn = get_db()
+    # The attempt and activity rows reference the material, so it must exist (and be the user's)
+    if not conn.execute('SELECT 1 FROM materials WHERE id = ? AND user_id = ?', (material_id, user_id)).fetchone():
+        return jsonify({'error': 'Material not found'}), 404
     
-    total = len(quiz_questions)
+    # Score in SQLite: join each question to its submitted answer (keyed by quiz id)
+    score = conn.execute('''
+        SELECT COUNT(*) AS total,
+               COALESCE(SUM(a.value = q.correct_answer), 0) AS correct
+        FROM quizzes q
+        LEFT JOIN json_each(?) a ON a.key = CAST(q.id AS TEXT) AND a.type = 'integer'
+        WHERE q.material_id = ?
+    ''', (orjson.dumps(option_by_question).decode(), material_id)).fetchone()
+    correct, total = score['correct'], score['total']
     
     # Save attempt
     conn.execute('''
@@ -1345,7 +1980,6 @@ def submit_quiz():
     ''', (user_id, material_id, 'quiz'))
     
     conn.commit()
-    conn.close()
     
     return jsonify({
         'success': True,
@@ -1373,10 +2007,9 @@ def ai_chat():
     context = ""
     if material_id:
         conn = get_db()
-        material = conn.execute('SELECT text_content FROM materials WHERE id = ?', (material_id,)).fetchone()
-        conn.close()
+        material = conn.execute(SQL_GET_MATERIAL_TEXT, (CHAT_CONTEXT_CHARS, material_id)).fetchone()
         if material:
-            context = material['text_content'][:4000]
+            context = material['text_content'] or ''
     
     try:
         if context:
@@ -1397,7 +2030,7 @@ Provide a clear, helpful answer."""
             'response': response.text
         })
     except Exception as e:
-        print(f"Error in chat: {e}")
+        logger.error("Error in chat: %s", e)
         return jsonify({'error': 'Failed to generate response'}), 500
 
 @app.route('/generate_visuals', methods=['POST'])
@@ -1416,7 +2049,6 @@ def generate_visuals():
     try:
         conn = get_db()
         material = conn.execute('SELECT text_content, title FROM materials WHERE id = ?', (material_id,)).fetchone()
-        conn.close()
         if not material:
             return jsonify({'error': 'Material not found'}), 404
 
@@ -1433,9 +2065,7 @@ def generate_visuals():
             'flow_html': flow_html
         })
     except Exception as e:
-        print(f"Error generating visuals: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generating visuals: %s", e)
         return jsonify({'error': 'Failed to generate visual content'}), 500
 
 @app.route('/explain_like_5', methods=['POST'])
@@ -1453,9 +2083,8 @@ def explain_like_5():
 
     try:
         conn = get_db()
-        row = conn.execute('SELECT text_content FROM materials WHERE id = ?', (material_id,)).fetchone()
-        conn.close()
-        context = row['text_content'][:4000] if row and row['text_content'] else ''
+        row = conn.execute(SQL_GET_MATERIAL_TEXT, (CHAT_CONTEXT_CHARS, material_id)).fetchone()
+        context = (row['text_content'] or '') if row else ''
 
         prompt = f"""
         Explain the following study material like I'm 5 years old.
@@ -1468,7 +2097,7 @@ def explain_like_5():
         response = model.generate_content(prompt)
         return jsonify({'success': True, 'text': response.text})
     except Exception as e:
-        print(f"Error in explain_like_5: {e}")
+        logger.error("Error in explain_like_5: %s", e)
         return jsonify({'error': 'Failed to generate explanation'}), 500
 
 @app.route('/logout')
@@ -1514,26 +2143,26 @@ def delete_material(material_id):
     user_id = session.get('user_id')
     
     conn = get_db()
-    material = conn.execute('SELECT * FROM materials WHERE id = ? AND user_id = ?', 
+    material = conn.execute('SELECT file_path FROM materials WHERE id = ? AND user_id = ?', 
                           (material_id, user_id)).fetchone()
     
     if not material:
-        conn.close()
         return jsonify({'error': 'Material not found'}), 404
     
-    # Delete file
+    # Delete the material and its dependent rows in one transaction; flush
+    # buffered activity first so none of it is written after the delete
+    flush_activity()
+    with conn:
+        conn.execute(SQL_DELETE_FLASHCARDS, (material_id,))
+        conn.execute(SQL_DELETE_QUIZZES, (material_id,))
+        conn.execute('DELETE FROM quiz_attempts WHERE material_id = ?', (material_id,))
+        conn.execute('DELETE FROM user_activity WHERE material_id = ?', (material_id,))
+        conn.execute('DELETE FROM materials WHERE id = ?', (material_id,))
+    
+    # Delete file once the rows are gone
     if material['file_path'] and os.path.exists(material['file_path']):
         os.remove(material['file_path'])
     
-    # Delete from database (cascade will handle related records)
-    conn.execute('DELETE FROM flashcards WHERE material_id = ?', (material_id,))
-    conn.execute('DELETE FROM quizzes WHERE material_id = ?', (material_id,))
-    conn.execute('DELETE FROM quiz_attempts WHERE material_id = ?', (material_id,))
-    conn.execute('DELETE FROM user_activity WHERE material_id = ?', (material_id,))
-    conn.execute('DELETE FROM materials WHERE id = ?', (material_id,))
-    conn.commit()
-    conn.close()
-    
     return jsonify({'success': True})
 
 # Error handlers
@@ -1549,25 +2178,40 @@ def internal_error(error):
 @app.template_filter('datetime')
 def datetime_filter(timestamp):
     """Format datetime for templates"""
+    # One "now" per request, and each distinct timestamp formatted only once
+    if '_now' not in g:
+        g._now = datetime.now()
+        g._datetime_labels = {}
+    label = g._datetime_labels.get(timestamp)
+    if label is not None:
+        return label
+    
     if isinstance(timestamp, str):
         dt = datetime.fromisoformat(timestamp)
     else:
         dt = timestamp
     
-    now = datetime.now()
-    diff = now - dt
+    diff = g._now - dt
     
     if diff.days == 0:
         if diff.seconds < 3600:
-            return f"{diff.seconds // 60} minutes ago"
-        return f"{diff.seconds // 3600} hours ago"
+            label = f"{diff.seconds // 60} minutes ago"
+        else:
+            label = f"{diff.seconds // 3600} hours ago"
     elif diff.days == 1:
-        return "Yesterday"
+        label = "Yesterday"
     elif diff.days < 7:
-        return f"{diff.days} days ago"
+        label = f"{diff.days} days ago"
     else:
-        return dt.strftime('%B %d, %Y')
+        label = dt.strftime('%B %d, %Y')
+    
+    g._datetime_labels[timestamp] = label
+    return label
 
 if __name__ == '__main__':
-    # Development server
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    if os.getenv('FLASK_DEV'):
+        # Development server (single process, reloader and debugger)
+        app.run(debug=True, host='0.0.0.0', port=5000)
+    else:
+        print("Run the production server with: gunicorn -c gunicorn_conf.py wsgi:app")
+        print("or set FLASK_DEV=1 to start the development server.")
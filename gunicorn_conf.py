@@ -0,0 +1,19 @@
+"""gunicorn settings for serving Intellexa (gunicorn -c gunicorn_conf.py wsgi:app)"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+
+# Threaded workers: requests spend most of their time waiting on Gemini, so
+# each process overlaps many of those waits instead of serializing them
+worker_class = 'gthread'
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 16))
+
+# Gemini calls and PDF uploads can take well over the default 30s
+timeout = 120
+graceful_timeout = 30
+keepalive = 5
+
+# gunicorn's own logs follow the same LOG_LEVEL as the app's logging config
+loglevel = os.getenv('LOG_LEVEL', 'info').lower()
@@ -0,0 +1,23 @@
+// Poll a queued generation job (/job/<id>) until it finishes.
+// Resolves with the job's JSON response; rejects if it is still pending after
+// timeoutMs, e.g. because the server worker running it was restarted.
+function waitForJob(jobId, { intervalMs = 2000, timeoutMs = 200000 } = {}) {
+    const deadline = Date.now() + timeoutMs;
+    return new Promise((resolve, reject) => {
+        const poll = () => {
+            fetch(`/job/${jobId}`)
+                .then(response => response.json())
+                .then(data => {
+                    if (data.status !== 'pending') {
+                        resolve(data);
+                    } else if (Date.now() >= deadline) {
+                        reject(new Error('Generation is taking too long. Please try again.'));
+                    } else {
+                        setTimeout(poll, intervalMs);
+                    }
+                })
+                .catch(reject);
+        };
+        poll();
+    });
+}
@@ -0,0 +1,2 @@
+"""WSGI entry point: gunicorn -c gunicorn_conf.py wsgi:app"""
+from app import app